@@ -9,74 +9,703 @@ import os
 import sys
 import subprocess
 import argparse
-import glob
+import json
+import re
+import signal
+import threading
 from pathlib import Path
 import tempfile
 import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Optional: PyAV reads container headers in-process, avoiding an ffprobe
+# fork/exec per clip. Falls back to ffprobe when it is not installed.
+try:
+    import av
+except ImportError:
+    av = None
+
+# Assumed number of cores a single libx264 encode keeps busy. Used to derive
+# how many clips can be encoded side by side without oversubscribing the CPU.
+DEFAULT_THREADS_PER_FFMPEG = 4
+
+# Bounds for an explicit --ffmpeg-threads / STITCH_FFMPEG_THREADS value
+MIN_FFMPEG_THREADS = 1
+MAX_FFMPEG_THREADS = 64
+
+# Above this many clips the concat is done hierarchically, merging groups of
+# TREE_CONCAT_FANOUT clips in parallel before the final pass
+TREE_CONCAT_THRESHOLD = 500
+TREE_CONCAT_FANOUT = 64
+
+# Parallel ffprobe/PyAV probes; these mostly wait on disk, not the CPU
+PROBE_WORKERS = 32
+
+# libx264 speed/compression presets offered on the command line
+X264_PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow']
+DEFAULT_PRESET = 'faster'
+
+# Hardware H.264 encoders, in order of preference for --encoder auto
+HW_ENCODERS = ['h264_nvenc', 'h264_vaapi', 'h264_videotoolbox']
+ENCODER_CHOICES = ['auto', 'libx264'] + HW_ENCODERS
+VAAPI_DEVICE = '/dev/dri/renderD128'
+
+# VideoToolbox's constant-quality mode only exists on Apple Silicon, so it
+# is driven by a bitrate scaled to the output size instead
+# (about 1.7 Mbit/s at 682x512, 6 Mbit/s at 1280x960)
+VIDEOTOOLBOX_BITS_PER_PIXEL = 5
+
+VIDEO_EXTENSIONS = frozenset({'.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv', '.m4v', '.webm'})
+
+_DIGITS_RE = re.compile(r'(\d+)')
+
+def natural_key(path):
+    """Sort key that orders embedded numbers numerically (clip2 before clip10)."""
+    # re.split with a capture group puts the digit runs at the odd indices;
+    # str.isdigit() would also accept e.g. superscripts that int() rejects
+    return [int(part) if i % 2 else part for i, part in enumerate(_DIGITS_RE.split(path))]
 
 def find_video_files(directory, extensions=None):
-    """Find all video files in the given directory."""
+    """Find all video files in the given directory (recursively)."""
     if extensions is None:
-        extensions = ['*.mp4', '*.avi', '*.mov', '*.mkv', '*.flv', '*.wmv', '*.m4v', '*.webm']
-    
+        exts = VIDEO_EXTENSIONS
+    else:
+        # Accept both '.mp4' and the older glob-style '*.mp4'
+        exts = frozenset(ext.lstrip('*').lower() for ext in extensions)
+
     video_files = []
-    for ext in extensions:
-        pattern = os.path.join(directory, '**', ext)
-        video_files.extend(glob.glob(pattern, recursive=True))
-    
+    seen_dirs = set()
+    # Like the previous glob('**') search, follow symlinked directories (but
+    # never enter the same real directory twice, which guards against loops)
+    for root, dirs, files in os.walk(directory, followlinks=True):
+        real_root = os.path.realpath(root)
+        if real_root in seen_dirs:
+            dirs[:] = []
+            continue
+        seen_dirs.add(real_root)
+        # ...and skip hidden directories and files
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in files:
+            if not name.startswith('.') and os.path.splitext(name)[1].lower() in exts:
+                video_files.append(os.path.join(root, name))
+
     # Sort files naturally (handles numeric sequences properly)
-    video_files.sort()
-    return video_files
+    return sorted(video_files, key=natural_key)
+
+# ffmpeg/ffprobe processes currently running, so they can all be killed on
+# Ctrl-C. They run in their own session and never see the terminal's SIGINT.
+_active_processes = set()
+_active_lock = threading.RLock()  # re-entered by the SIGINT handler
+_cancelled = threading.Event()
+
+def _popen_ffmpeg(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, **kwargs):
+    """
+    Start ffmpeg/ffprobe without a terminal on stdin and track the process.
+
+    Raises subprocess.CalledProcessError once cancel_ffmpeg() has been called,
+    so queued pool work fails fast instead of starting new processes.
+    """
+    with _active_lock:
+        if _cancelled.is_set():
+            raise subprocess.CalledProcessError(-signal.SIGINT, cmd)
+        process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=stdout,
+            stderr=stderr,
+            close_fds=True,
+            start_new_session=True,
+            **kwargs
+        )
+        _active_processes.add(process)
+    return process
+
+def _release_ffmpeg(process):
+    """Stop tracking a finished process."""
+    with _active_lock:
+        _active_processes.discard(process)
+
+def run_ffmpeg(cmd, capture_output=False, timeout=None):
+    """
+    Run an ffmpeg/ffprobe command to completion.
+
+    stdin is /dev/null, stderr is captured, and stdout is captured only when
+    capture_output is True. Raises subprocess.CalledProcessError (with the
+    captured stderr) on a non-zero exit, like subprocess.run(check=True).
+    """
+    process = _popen_ffmpeg(
+        cmd,
+        stdout=subprocess.PIPE if capture_output else subprocess.DEVNULL,
+        universal_newlines=True,
+        errors='replace'
+    )
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        raise
+    finally:
+        _release_ffmpeg(process)
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+def cancel_ffmpeg():
+    """Kill every running ffmpeg/ffprobe and refuse to start new ones."""
+    with _active_lock:
+        _cancelled.set()
+        processes = list(_active_processes)
+    for process in processes:
+        try:
+            process.kill()
+        except OSError:
+            pass
 
 def check_ffmpeg():
     """Check if ffmpeg is installed and accessible."""
     try:
-        subprocess.run(['ffmpeg', '-version'], 
-                      stdout=subprocess.DEVNULL, 
-                      stderr=subprocess.DEVNULL, 
-                      check=True)
+        run_ffmpeg(['ffmpeg', '-version'])
         return True
     except (subprocess.CalledProcessError, FileNotFoundError):
         return False
 
-def create_file_list(video_files, temp_dir):
+_CONCAT_QUOTE_TABLE = str.maketrans({"'": "'\\''"})
+
+def create_file_list(video_files, temp_dir, list_name='video_list.txt'):
     """Create a temporary file list for ffmpeg concat demuxer."""
-    file_list_path = os.path.join(temp_dir, 'video_list.txt')
-    
+    file_list_path = os.path.join(temp_dir, list_name)
+    cwd = os.getcwd()
+
+    # Use absolute paths and escape single quotes the way the concat demuxer
+    # expects inside a quoted string: close the quote, add \', reopen
+    lines = (
+        "file '{}'\n".format(
+            (p if os.path.isabs(p) else os.path.normpath(os.path.join(cwd, p))).translate(_CONCAT_QUOTE_TABLE)
+        )
+        for p in video_files
+    )
     with open(file_list_path, 'w') as f:
-        for video_file in video_files:
-            # Escape single quotes and use absolute paths
-            abs_path = os.path.abspath(video_file)
-            escaped_path = abs_path.replace("'", "'\"'\"'")
-            f.write(f"file '{escaped_path}'\n")
+        f.writelines(lines)
     
     return file_list_path
 
+def _encoder_input_args(encoder):
+    """Global/input ffmpeg options an encoder needs before '-i'."""
+    if encoder == 'h264_vaapi':
+        return ['-vaapi_device', VAAPI_DEVICE]
+    return []
+
+def _encoder_output_args(encoder, preset=DEFAULT_PRESET, tune=None, width=1280, height=960):
+    """Video codec options for the chosen encoder at a width x height output."""
+    if encoder == 'h264_nvenc':
+        return ['-c:v', 'h264_nvenc', '-pix_fmt', 'yuv420p', '-rc', 'vbr', '-cq', '23', '-b:v', '0']
+    if encoder == 'h264_vaapi':
+        # Frames are uploaded to the GPU by the filter chain (see _encode_one)
+        return ['-c:v', 'h264_vaapi', '-qp', '23']
+    if encoder == 'h264_videotoolbox':
+        bitrate = width * height * VIDEOTOOLBOX_BITS_PER_PIXEL
+        return ['-c:v', 'h264_videotoolbox', '-pix_fmt', 'yuv420p', '-b:v', str(bitrate)]
+
+    args = ['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-preset', preset]
+    if tune:
+        args += ['-tune', tune]
+    return args
+
+def detect_hw_encoder():
+    """
+    Return the first usable hardware H.264 encoder, or None.
+
+    ffmpeg builds often list encoders (NVENC in particular) that have no
+    matching hardware, so every candidate is confirmed with a one-frame test
+    encode before it is picked.
+    """
+    try:
+        result = run_ffmpeg(['ffmpeg', '-hide_banner', '-encoders'], capture_output=True)
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+    for encoder in HW_ENCODERS:
+        if encoder not in result.stdout:
+            continue
+        vf = 'format=nv12,hwupload' if encoder == 'h264_vaapi' else 'format=yuv420p'
+        cmd = (['ffmpeg', '-loglevel', 'error'] + _encoder_input_args(encoder) +
+               ['-f', 'lavfi', '-i', 'color=black:size=256x256', '-frames:v', '1',
+                '-vf', vf] + _encoder_output_args(encoder, width=256, height=256) + ['-f', 'null', '-'])
+        try:
+            run_ffmpeg(cmd, timeout=30)
+            return encoder
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            continue
+
+    return None
+
+def _fraction_str(value):
+    """Format a Fraction the way ffprobe prints rates and time bases ('30/1')."""
+    return f"{value.numerator}/{value.denominator}" if value is not None else None
+
+def _probe_with_pyav(video_file):
+    """Read stream info in-process with PyAV (same result as get_video_info)."""
+    with av.open(video_file) as container:
+        video = container.streams.video[0]
+        audio = container.streams.audio[0] if container.streams.audio else None
+        return {
+            'width': video.codec_context.width,
+            'height': video.codec_context.height,
+            'codec_name': video.codec_context.name,
+            'profile': video.codec_context.profile,
+            'level': getattr(video.codec_context, 'level', None),
+            'pix_fmt': video.codec_context.pix_fmt,
+            'r_frame_rate': _fraction_str(video.base_rate),
+            'time_base': _fraction_str(video.time_base),
+            'audio_codec': audio.codec_context.name if audio else None,
+            'sample_rate': audio.codec_context.sample_rate if audio else None,
+            'channels': audio.codec_context.channels if audio else None,
+        }
+
 def get_video_info(video_file):
-    """Get basic info about a video file."""
+    """
+    Probe a video file with PyAV when available, otherwise ffprobe.
+
+    Returns a dict with the first video stream's width, height, codec_name,
+    profile, level, pix_fmt, r_frame_rate and time_base plus the first audio
+    stream's codec, sample_rate and channels (audio_codec, sample_rate and
+    channels are None when the file has no audio), or None if the file cannot
+    be probed.
+    """
+    if av is not None:
+        try:
+            return _probe_with_pyav(video_file)
+        except Exception:
+            pass  # Fall back to ffprobe
+
+    cmd = [
+        'ffprobe', '-v', 'quiet', '-print_format', 'json',
+        '-show_entries', 'stream=codec_type,codec_name,profile,level,width,height,pix_fmt,'
+                         'r_frame_rate,time_base,sample_rate,channels',
+        video_file
+    ]
     try:
+        result = run_ffmpeg(cmd, capture_output=True)
+        streams = json.loads(result.stdout).get('streams', [])
+    except (subprocess.CalledProcessError, ValueError):
+        return None
+
+    video = next((st for st in streams if st.get('codec_type') == 'video'), None)
+    if video is None:
+        return None
+    audio = next((st for st in streams if st.get('codec_type') == 'audio'), None)
+
+    return {
+        'width': video.get('width'),
+        'height': video.get('height'),
+        'codec_name': video.get('codec_name'),
+        'profile': video.get('profile'),
+        'level': video.get('level'),
+        'pix_fmt': video.get('pix_fmt'),
+        'r_frame_rate': video.get('r_frame_rate'),
+        'time_base': video.get('time_base'),
+        'audio_codec': audio.get('codec_name') if audio else None,
+        # ffprobe reports the sample rate as a string
+        'sample_rate': int(audio['sample_rate']) if audio and audio.get('sample_rate') else None,
+        'channels': audio.get('channels') if audio else None,
+    }
+
+def _audio_mode(infos):
+    """
+    Decide how audio is handled across the whole run.
+
+    'none' when no clip has audio (encode with -an), 'all' when every clip
+    does, and 'mixed' otherwise; silent clips then get a generated silent
+    track so every clip has the same streams for the concat copy. Clips that
+    could not be probed are assumed to have audio.
+    """
+    has_audio = [info is None or info['audio_codec'] is not None for info in infos]
+    if not any(has_audio):
+        return 'none'
+    if all(has_audio):
+        return 'all'
+    return 'mixed'
+
+def _is_conformant(info, target_w, target_h, audio_mode):
+    """True if a probed clip already matches what the re-encode would produce."""
+    # In 'mixed' mode every clip's audio is normalised to 48kHz stereo, which
+    # a passed-through clip cannot be guaranteed to match
+    return (
+        audio_mode != 'mixed'
+        and info is not None
+        and info['width'] == target_w
+        and info['height'] == target_h
+        and info['codec_name'] == 'h264'
+        and info['pix_fmt'] == 'yuv420p'
+        and info['audio_codec'] == (None if audio_mode == 'none' else 'aac')
+    )
+
+def _can_pass_through(infos, target_w, target_h, audio_mode):
+    """
+    True if the clips can be concatenated as they are.
+
+    Every clip must be conformant and all of them must share the remaining
+    stream parameters (profile, level, frame rate, time base and audio
+    format): the concat demuxer takes those from the first file, so a clip
+    that differs would play at the wrong speed or lose sync.
+    """
+    return (
+        all(_is_conformant(info, target_w, target_h, audio_mode) for info in infos)
+        and all(info == infos[0] for info in infos)
+    )
+
+def _ffmpeg_threads_per_invocation(n_workers):
+    """Split the available cores evenly between n_workers parallel ffmpeg processes."""
+    return max(1, (os.cpu_count() or n_workers) // n_workers)
+
+def _link_clip(idx, src, dst_template):
+    """Link an already conformant clip to dst_template % idx and return the path to concat."""
+    dst = dst_template % idx
+    abs_src = os.path.abspath(src)
+    try:
+        os.symlink(abs_src, dst)
+    except OSError:
+        # Symlinks may be unavailable (e.g. Windows without privileges);
+        # the concat list can point at the source directly instead.
+        return abs_src
+    return dst
+
+# Per-run options shared by every clip's encode, bound once in
+# _preprocess_clips. dst_template % idx gives each clip's output path;
+# threads is the per-process thread budget.
+_EncodeSettings = namedtuple('_EncodeSettings', [
+    'dst_template', 'target_w', 'target_h', 'numbered', 'threads',
+    'encoder', 'preset', 'tune', 'audio_mode', 'pass_through',
+])
+
+def _build_video_filter(src, target_w, target_h, numbered, encoder):
+    """Build the -vf filter chain for one clip."""
+    # Build the mandatory 4:3 filter (crop -> scale -> pad). Cropping wide
+    # sources to 4:3 first is free (crop only moves data pointers) and means
+    # the scaler touches fewer pixels; narrow sources are scaled to the
+    # target height and padded, exactly as before.
+    vf_parts = [
+        f"crop='min(iw,ih*{target_w}/{target_h})':ih",
+        f"scale={target_w}:{target_h}:force_original_aspect_ratio=decrease:flags=bilinear",
+        f"pad={target_w}:{target_h}:(ow-iw)/2:(oh-ih)/2"
+    ]
+
+    # Optional numbering overlay
+    if numbered:
+        # Use the filename (without path) as overlay text
+        label_text = os.path.basename(src)
+        # Escape characters that ffmpeg drawtext would interpret
+        label_text = label_text.replace(':', '\\:').replace("'", "\\'")
+        # The label is static, so expansion=none skips re-parsing it for
+        # %{...} sequences on every frame (and keeps '%' in names literal)
+        vf_parts.append(
+            f"drawtext=text='{label_text}':expansion=none:fontcolor=black:fontsize=24:box=1:boxcolor=white@1:boxborderw=10:x=20:y=20"
+        )
+
+    # VAAPI encodes from GPU surfaces, so hand the filtered frames over last
+    if encoder == 'h264_vaapi':
+        vf_parts.append("format=nv12,hwupload")
+
+    return ",".join(vf_parts)
+
+def _build_encode_cmd(clips, settings):
+    """
+    Build one ffmpeg command that re-encodes every (idx, src, info) in clips.
+
+    Each clip is its own input with its own mapped output. settings.threads
+    is the budget for the whole process and is split between the clips.
+    Returns the command and the list of (idx, dst) outputs it writes.
+    """
+    audio_mode = settings.audio_mode
+    # All decoders and encoders in the batch run at once, so share the
+    # per-process thread budget between them
+    threads = max(1, settings.threads // len(clips))
+    cmd = ["ffmpeg", "-loglevel", "error", "-y"] + _encoder_input_args(settings.encoder)
+    output_args = []
+    outputs = []
+    n_inputs = 0
+
+    for idx, src, info in clips:
+        cmd += ["-fflags", "+genpts", "-threads", str(threads), "-i", src]
+        video_input = n_inputs
+        n_inputs += 1
+
+        dst = settings.dst_template % idx
+        vf_filter = _build_video_filter(src, settings.target_w, settings.target_h, settings.numbered, settings.encoder)
+        args = ["-map", f"{video_input}:v:0", "-vf", vf_filter, "-threads", str(threads)]
+        args += _encoder_output_args(settings.encoder, settings.preset, settings.tune,
+                                     settings.target_w, settings.target_h)
+
+        if audio_mode == 'none':
+            args += ["-an"]
+        elif audio_mode == 'mixed' and info is not None and info['audio_codec'] is None:
+            # Give silent clips a silent track matching the others
+            cmd += ["-f", "lavfi", "-i", "anullsrc=cl=stereo:r=48000"]
+            args += ["-map", f"{n_inputs}:a:0", "-shortest"]
+            n_inputs += 1
+        else:
+            args += ["-map", f"{video_input}:a:0?"]
+
+        if audio_mode != 'none':
+            args += ["-c:a", "aac"]
+            if audio_mode == 'mixed':
+                args += ["-ar", "48000", "-ac", "2"]
+
+        # Start every clip's timestamps at zero so the concat demuxer can
+        # splice them without PTS discontinuities
+        args += ["-avoid_negative_ts", "make_zero", dst]
+        output_args += args
+        outputs.append((idx, dst))
+
+    return cmd + output_args, outputs
+
+def _encode_one(idx, src, info, settings):
+    """
+    Re-encode a single clip to the 4:3 target resolution.
+
+    With settings.pass_through set the clip is linked to its destination
+    unchanged instead. Output paths come from settings.dst_template % idx.
+
+    Returns a tuple (idx, dst) where dst is the processed file path, or None
+    if ffmpeg failed on this clip.
+    """
+    if settings.pass_through:
+        return idx, _link_clip(idx, src, settings.dst_template)
+
+    cmd, outputs = _build_encode_cmd([(idx, src, info)], settings)
+
+    try:
+        run_ffmpeg(cmd)
+    except subprocess.CalledProcessError as e:
+        if _cancelled.is_set():
+            # Killed or refused by cancel_ffmpeg(); not a real failure
+            return idx, None
+        reason = e.stderr.strip().splitlines()[-1] if e.stderr and e.stderr.strip() else f"exit code {e.returncode}"
+        print(f"\n❌ Failed to process '{src}' ({reason}). Skipping…")
+        return idx, None
+
+    return outputs[0]
+
+def _encode_batch(batch, settings):
+    """
+    Re-encode a batch of (idx, src, info) clips with a single ffmpeg process.
+
+    Every clip becomes its own input and mapped output, which saves one
+    process start per clip. If the combined run fails, the clips are retried
+    one at a time so a single bad file only drops itself.
+
+    Returns a list of (idx, dst) tuples like _encode_one.
+    """
+    if len(batch) == 1:
+        idx, src, info = batch[0]
+        return [_encode_one(idx, src, info, settings)]
+
+    if settings.pass_through:
+        return [(idx, _link_clip(idx, src, settings.dst_template)) for idx, src, _ in batch]
+
+    cmd, outputs = _build_encode_cmd(batch, settings)
+
+    try:
+        run_ffmpeg(cmd)
+    except subprocess.CalledProcessError:
+        if _cancelled.is_set():
+            return [(idx, None) for idx, _, _ in batch]
+        return [_encode_one(idx, src, info, settings) for idx, src, info in batch]
+
+    return outputs
+
+def _concat_group(files, temp_dir, name):
+    """Stream-copy concatenate files into temp_dir/<name>.mp4 and return its path."""
+    file_list_path = create_file_list(files, temp_dir, f"{name}.txt")
+    dst = os.path.join(temp_dir, f"{name}.mp4")
+    cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'concat', '-safe', '0', '-i', file_list_path,
+        '-c', 'copy', dst
+    ]
+    run_ffmpeg(cmd)
+    return dst
+
+def _tree_concat(files, temp_dir, fanout=TREE_CONCAT_FANOUT, jobs=1):
+    """
+    Merge files in groups of `fanout` until at most `fanout` remain.
+
+    Each level's merges are independent stream copies and run in parallel.
+    The returned (shorter) list keeps the original order and is meant for the
+    final concat. Raises subprocess.CalledProcessError if a merge fails.
+    """
+    level = 0
+    while len(files) > fanout:
+        level += 1
+        groups = [files[i:i + fanout] for i in range(0, len(files), fanout)]
+        print(f"  🌳 Merging {len(files)} clips into {len(groups)} intermediate files (level {level})")
+
+        def merge(group_idx, group, level=level):
+            # A trailing group of one file needs no merge
+            if len(group) == 1:
+                return group[0]
+            return _concat_group(group, temp_dir, f"merge_{level}_{group_idx:05d}")
+
+        with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(groups)))) as executor:
+            files = list(executor.map(merge, range(len(groups)), groups))
+    return files
+
+def _preprocess_clips(video_files, infos, temp_dir, jobs, batch_size, target_w, target_h, numbered, threads, encoder, preset, tune, re_encode, merge_fanout=None):
+    """
+    Re-encode every clip in parallel, or pass them all through unchanged
+    when the whole set already matches the target (see _can_pass_through)
+    and neither numbering nor re_encode is requested.
+
+    Returns the processed file paths in input order; clips that failed are
+    left out. With merge_fanout set, each run of merge_fanout consecutive
+    clips is stream-copied into one intermediate file as soon as the whole
+    run has finished, overlapping the first concat level with the remaining
+    encodes; the intermediate files are returned instead. Raises
+    subprocess.CalledProcessError if such a merge fails.
+    """
+    audio_mode = _audio_mode(infos)
+    pass_through = not numbered and not re_encode and _can_pass_through(infos, target_w, target_h, audio_mode)
+    if pass_through:
+        print(f"⏩ All clips already share one H.264 format at {target_w}x{target_h}; using them as they are")
+    else:
+        print("🛠️  Re-encoding each clip to 4:3{}...".format(" with numbering" if numbered else ""))
+        if audio_mode == 'none':
+            print("🔇 No clip has audio; encoding video only")
+        elif audio_mode == 'mixed':
+            print("🔈 Some clips have no audio; adding silent tracks so all clips match")
+
+    # One slot per clip, filled by position, so input order is kept
+    # without sorting
+    results = [None] * len(video_files)
+    # temp_dir can itself contain '%' (e.g. from $TMPDIR); keep it literal
+    dst_template = os.path.join(temp_dir.replace('%', '%%'), "processed_%05d.mp4")
+    settings = _EncodeSettings(dst_template, target_w, target_h, numbered, threads,
+                               encoder, preset, tune, audio_mode, pass_through)
+    completed = 0
+
+    group_size = merge_fanout or len(video_files)
+    n_groups = -(-len(video_files) // group_size)
+    remaining = [min(group_size, len(video_files) - g * group_size) for g in range(n_groups)]
+    merged = [None] * n_groups
+
+    def merge(g):
+        files = [dst for dst in results[g * group_size:(g + 1) * group_size] if dst is not None]
+        if len(files) <= 1:
+            return files
+        return [_concat_group(files, temp_dir, f"early_merge_{g:05d}")]
+
+    # Merges are pure I/O, so a single thread keeps up without stealing
+    # cores from the encoders
+    with ThreadPoolExecutor(max_workers=jobs) as executor, \
+         ThreadPoolExecutor(max_workers=1) as merge_executor:
+        clips = [(idx, src, info) for idx, (src, info) in enumerate(zip(video_files, infos), start=1)]
+        batches = [clips[i:i + batch_size] for i in range(0, len(clips), batch_size)]
+        futures = [executor.submit(_encode_batch, batch, settings) for batch in batches]
+        # Progress is printed from this thread only, at most every 100ms
+        last_report = 0.0
+        try:
+            for future in as_completed(futures):
+                for idx, dst in future.result():
+                    results[idx - 1] = dst
+                    completed += 1
+                    g = (idx - 1) // group_size
+                    remaining[g] -= 1
+                    if merge_fanout and remaining[g] == 0:
+                        merged[g] = merge_executor.submit(merge, g)
+                now = time.monotonic()
+                if now - last_report >= 0.1 or completed == len(video_files):
+                    last_report = now
+                    print(f"  ▶️  Processed clip {completed}/{len(video_files)}", end="\r")
+        except KeyboardInterrupt:
+            # Kill the running encodes (the signal handler is not installed
+            # when called as a library) and drop the queued clips instead of
+            # letting the pool work through them
+            cancel_ffmpeg()
+            executor.shutdown(wait=False, cancel_futures=True)
+            merge_executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+        processed_files = [dst for dst in results if dst is not None]
+        print("\n✅ Pre-processing complete. {}/{} clips processed.".format(len(processed_files), len(video_files)))
+
+        if merge_fanout and processed_files:
+            print(f"  🌳 Finishing {n_groups} intermediate merges")
+            return [path for future in merged for path in future.result()]
+
+    return processed_files
+
+def _is_uniform(infos, target_w, target_h):
+    """
+    True if every clip is H.264 at the target size and all probed stream
+    parameters (profile, level, pix_fmt, frame rate, time base and audio
+    format) are identical, so the clips can be spliced without re-encoding.
+    """
+    if not infos or any(info is None for info in infos):
+        return False
+    first = infos[0]
+    return (
+        first['codec_name'] == 'h264'
+        and (first['width'], first['height']) == (target_w, target_h)
+        and first['audio_codec'] in ('aac', None)
+        and all(info == first for info in infos)
+    )
+
+def _remux_to_ts(video_files, infos, temp_dir, jobs):
+    """
+    Stream-copy every clip into an Annex B MPEG-TS segment.
+
+    Returns the segment paths in input order, or None if any remux fails.
+    """
+    width, height = infos[0]['width'], infos[0]['height']
+    print(f"⚡ All clips share one format ({width}x{height}); remuxing without re-encoding")
+
+    def remux(idx, src):
+        dst = os.path.join(temp_dir, f"segment_{idx:05d}.ts")
         cmd = [
-            'ffprobe', '-v', 'quiet', '-print_format', 'json',
-            '-show_format', '-show_streams', video_file
+            'ffmpeg', '-loglevel', 'error', '-y', '-i', src,
+            '-map', '0:v:0', '-map', '0:a:0?', '-c', 'copy',
+            '-bsf:v', 'h264_mp4toannexb', '-f', 'mpegts', dst
         ]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        return True
+        run_ffmpeg(cmd)
+        return dst
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(remux, range(1, len(video_files) + 1), video_files))
     except subprocess.CalledProcessError:
-        return False
+        print("⚠️  Remux failed; falling back to re-encoding")
+        return None
 
-def stitch_videos(input_dir, output_file, check_compatibility=True, numbered=False, target_resolution=None, position=None, number=None):
+def stitch_videos(input_dir, output_file, check_compatibility=True, numbered=False, target_resolution=None, position=None, number=None, jobs=None, ffmpeg_threads=None, encoder='auto', preset=None, tune=None, re_encode=False, batch_size=1, fast_copy=False):
     """
     Stitch multiple videos together.
     
     Args:
         input_dir: Directory containing video files
         output_file: Output video file path
-        check_compatibility: Whether to check video compatibility first
+        check_compatibility: Whether to warn about clips that cannot be probed
         numbered: Overlay the clip index in the bottom-left corner of every
                    video when True.
         target_resolution: Optional tuple (width, height) for 4:3 output
         position: Optional starting position in the video list (1-based)
         number: Optional number of videos to take from the position
+        jobs: Optional number of clips to re-encode in parallel (defaults to
+              the CPU count divided by DEFAULT_THREADS_PER_FFMPEG)
+        ffmpeg_threads: Optional thread count passed to each ffmpeg encode
+                        (defaults to the CPU count divided by jobs)
+        encoder: H.264 encoder for the per-clip re-encode; 'auto' picks the
+                 first working hardware encoder and falls back to libx264
+        preset: libx264 preset used for the per-clip re-encode (defaults to
+                DEFAULT_PRESET)
+        tune: Optional libx264 tune (e.g. 'fastdecode')
+        re_encode: Re-encode every clip, even when all of them already share
+                   one H.264 format at the target resolution
+        batch_size: Number of clips handled by each ffmpeg process
+        fast_copy: When every clip shares one H.264 format at the target
+                   resolution, splice them without re-encoding
     """
     
     print("🎬 Video Stitching Script Started")
@@ -92,6 +721,14 @@ def stitch_videos(input_dir, output_file, check_compatibility=True, numbered=Fal
         return False
     
     print("✅ ffmpeg found")
+
+    if encoder == 'auto':
+        encoder = detect_hw_encoder() or 'libx264'
+    print(f"🎛️  Using encoder: {encoder}")
+    if encoder != 'libx264' and (preset is not None or tune is not None):
+        print(f"⚠️  Warning: --preset/--tune only apply to libx264 and are ignored by {encoder}")
+    if preset is None:
+        preset = DEFAULT_PRESET
     
     # Find video files
     print(f"🔍 Searching for video files in: {input_dir}")
@@ -120,6 +757,10 @@ def stitch_videos(input_dir, output_file, check_compatibility=True, numbered=Fal
         else:
             end_index = min(start_index + number, len(video_files))
             video_files = video_files[start_index:end_index]
+
+        if not video_files:
+            print("❌ No video files selected with the given --position/--number")
+            return False
         
         print(f"📍 Selected videos {position} to {position + len(video_files) - 1} from original set")
         print(f"📁 Processing {len(video_files)} video files")
@@ -129,105 +770,117 @@ def stitch_videos(input_dir, output_file, check_compatibility=True, numbered=Fal
         target_resolution = (1280, 960)
     target_w, target_h = target_resolution
 
-    # Check compatibility if requested
-    if check_compatibility:
-        print("🔄 Checking video compatibility...")
-        incompatible_files = []
-        for i, video_file in enumerate(video_files[:10]):  # Check first 10 files as sample
-            if not get_video_info(video_file):
-                incompatible_files.append(video_file)
-            if i % 100 == 0:
-                print(f"  Checked {i+1}/{min(10, len(video_files))} files...")
-        
-        if incompatible_files:
-            print(f"⚠️  Found {len(incompatible_files)} potentially incompatible files")
-    
     # ------------------------------------------------------------------
     # NEW PIPELINE: We first pre-process each clip into a temporary 4:3
     #               version (with optional numbering overlay). After all clips
     #               are rendered we concatenate them via stream copy which is
     #               fast and avoids an additional full-length re-encode.
+    #               If every clip already shares one H.264 format at the
+    #               target size they are passed through untouched instead,
+    #               unless numbering is requested.
     # ------------------------------------------------------------------
 
     with tempfile.TemporaryDirectory() as temp_dir:
-        processed_files = []
-
-        print("🛠️  Re-encoding each clip to 4:3{}...".format(" with numbering" if numbered else ""))
+        if jobs is None:
+            jobs = max(1, (os.cpu_count() or 4) // DEFAULT_THREADS_PER_FFMPEG)
+        jobs = max(1, min(jobs, -(-len(video_files) // batch_size)))
+        if ffmpeg_threads is None:
+            ffmpeg_threads = _ffmpeg_threads_per_invocation(jobs)
+        print(f"⚙️  Using {jobs} parallel ffmpeg job(s) with {ffmpeg_threads} thread(s) each")
 
-        for idx, src in enumerate(video_files, start=1):
-            dst = os.path.join(temp_dir, f"processed_{idx:05d}.mp4")
-            
-            # Build the mandatory 4:3 filter (scale -> crop -> pad)
-            vf_parts = [
-                f"scale=-1:{target_h}",
-                f"crop='min(iw,{target_w})':'min(ih,{target_h})'",
-                f"pad={target_w}:{target_h}:(ow-iw)/2:(oh-ih)/2"
-            ]
-
-            # Optional numbering overlay
-            if numbered:
-                # Use the filename (without path) as overlay text
-                label_text = os.path.basename(src)
-                # Escape characters that ffmpeg drawtext would interpret
-                label_text = label_text.replace(':', '\\:').replace("'", "\\'")
-                vf_parts.append(
-                    f"drawtext=text='{label_text}':fontcolor=black:fontsize=24:box=1:boxcolor=white@1:boxborderw=10:x=20:y=20"
-                )
+        # Probe every clip up front: the formats of the whole set decide
+        # whether --fast-copy applies and how each clip's audio is encoded.
+        # Probing is I/O bound, so it gets a wider pool than the encodes.
+        with ThreadPoolExecutor(max_workers=min(PROBE_WORKERS, len(video_files))) as executor:
+            infos = list(executor.map(get_video_info, video_files))
 
-            vf_filter = ",".join(vf_parts)
+        # Check compatibility if requested, reusing the probe results
+        if check_compatibility:
+            print("🔄 Checking video compatibility...")
+            incompatible_files = [f for f, info in zip(video_files, infos) if not info]
+            print(f"  Checked {len(video_files)} files")
 
-            cmd = [
-                "ffmpeg", "-loglevel", "error", "-y", "-i", src,
-                "-vf", vf_filter,
-                "-c:v", "libx264", "-pix_fmt", "yuv420p",
-                "-c:a", "aac", "-preset", "medium",
-                dst
-            ]
+            if incompatible_files:
+                print(f"⚠️  Found {len(incompatible_files)} potentially incompatible files")
 
-            print(f"  ▶️  Processing clip {idx}/{len(video_files)}", end="\r")
+        ts_files = None
+        if fast_copy and not numbered:
+            if _is_uniform(infos, target_w, target_h):
+                ts_files = _remux_to_ts(video_files, infos, temp_dir, jobs)
+            else:
+                print(f"ℹ️  Clips are not all H.264 at {target_w}x{target_h}; --fast-copy not possible, re-encoding instead")
 
+        if ts_files is not None:
+            # Join the MPEG-TS segments through a list file; a single
+            # 'concat:a.ts|b.ts|...' argument would outgrow the Windows
+            # command-line limit at a couple of thousand clips
+            file_list_path = create_file_list(ts_files, temp_dir)
+            concat_input = ['-f', 'concat', '-safe', '0', '-i', file_list_path, '-bsf:a', 'aac_adtstoasc']
+        else:
+            # Very long lists are merged hierarchically so the final concat
+            # only has to open a handful of files. The first level runs while
+            # later clips are still encoding.
+            tree = len(video_files) > TREE_CONCAT_THRESHOLD
             try:
-                subprocess.run(cmd, check=True)
+                processed_files = _preprocess_clips(
+                    video_files, infos, temp_dir, jobs, batch_size, target_w, target_h,
+                    numbered, ffmpeg_threads, encoder, preset, tune, re_encode,
+                    merge_fanout=TREE_CONCAT_FANOUT if tree else None
+                )
+                if tree:
+                    processed_files = _tree_concat(processed_files, temp_dir, jobs=jobs)
             except subprocess.CalledProcessError:
-                print(f"\n❌ Failed to process '{src}'. Skipping…")
-                continue
-
-            processed_files.append(dst)
-
-        print("\n✅ Pre-processing complete. {}/{} clips processed.".format(len(processed_files), len(video_files)))
+                print("\n❌ Error while merging intermediate files")
+                return False
 
-        if not processed_files:
-            print("❌ No clips could be processed. Abort.")
-            return False
+            if not processed_files:
+                print("❌ No clips could be processed. Abort.")
+                return False
 
-        # Create concat list for processed files
-        file_list_path = create_file_list(processed_files, temp_dir)
+            # Create concat list for processed files
+            file_list_path = create_file_list(processed_files, temp_dir)
+            concat_input = ['-f', 'concat', '-safe', '0', '-i', file_list_path]
 
         # Final concatenation using stream copy (very fast)
-        cmd = [
-            'ffmpeg', '-f', 'concat', '-safe', '0', '-i', file_list_path,
-            '-c', 'copy', '-y', output_file
-        ]
+        cmd = (
+            ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostats', '-progress', 'pipe:1'] +
+            concat_input +
+            ['-c', 'copy', '-movflags', '+faststart', '-y', output_file]
+        )
 
         print("🚀 Concatenating processed clips…")
         
         start_time = time.time()
         
+        process = None
+        # Only stdout is read while ffmpeg runs, so stderr goes to a file
+        # rather than a pipe that could fill up and block ffmpeg
+        stderr_file = tempfile.TemporaryFile(dir=temp_dir)
         try:
-            process = subprocess.Popen(
+            # Binary pipes: the progress lines are only matched as bytes and
+            # decoded when a status line is actually printed
+            process = _popen_ffmpeg(
                 cmd,
                 stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                universal_newlines=True
+                stderr=stderr_file
             )
 
-            # Monitor concatenation progress (based on stderr lines)
-            while True:
-                output_line = process.stderr.readline()
-                if output_line == '' and process.poll() is not None:
-                    break
-                if output_line and 'frame=' in output_line:
-                    print(output_line.strip(), end='\r')
+            # Monitor concatenation progress. ffmpeg writes blocks of
+            # key=value lines to stdout, each terminated by a 'progress=' line;
+            # print one status line per block, at most once a second.
+            progress = {}
+            last_report = 0.0
+            for output_line in process.stdout:
+                key, _, value = output_line.strip().partition(b'=')
+                if key != b'progress':
+                    progress[key] = value
+                    continue
+                now = time.monotonic()
+                if now - last_report >= 1.0 or value == b'end':
+                    last_report = now
+                    frame = progress.get(b'frame', b'?').decode('ascii', 'replace')
+                    out_time = progress.get(b'out_time', b'?').decode('ascii', 'replace')
+                    print(f"  frame={frame} time={out_time}", end='\r')
 
             process.wait()
             
@@ -243,17 +896,28 @@ def stitch_videos(input_dir, output_file, check_compatibility=True, numbered=Fal
                 
                 return True
             else:
-                error_output = process.stderr.read()
+                stderr_file.seek(0)
+                error_output = stderr_file.read().decode('utf-8', 'replace')
                 print(f"\n❌ Error during concatenation:")
                 print(error_output)
                 return False
                 
         except KeyboardInterrupt:
-            print("\n⏹️  Operation cancelled by user")
-            return False
+            # Let main() report the cancellation and exit with 130
+            cancel_ffmpeg()
+            raise
         except Exception as e:
             print(f"\n❌ Unexpected error: {e}")
             return False
+        finally:
+            if process is not None:
+                _release_ffmpeg(process)
+            stderr_file.close()
+
+def _handle_sigint(signum, frame):
+    """Kill child ffmpeg processes before raising KeyboardInterrupt."""
+    cancel_ffmpeg()
+    raise KeyboardInterrupt
 
 def main():
     parser = argparse.ArgumentParser(description='Stitch multiple videos together')
@@ -266,10 +930,11 @@ def main():
                        help='Output video file name (default: stitched_video.mp4)')
     parser.add_argument('--re-encode', 
                        action='store_true',
-                       help='Re-encode videos for compatibility (slower but more reliable)')
+                       help='Re-encode every clip, even when all of them already share one '
+                            'H.264/yuv420p format at the target resolution (slower but more reliable)')
     parser.add_argument('--no-check', 
                        action='store_true',
-                       help='Skip compatibility check')
+                       help='Do not warn about clips that fail to probe (every clip is still probed)')
     # Always convert to 4:3 so no flag for this any more. The user can still
     # choose a target resolution provided it is 4:3.
     parser.add_argument('--resolution', default='682x512',
@@ -284,6 +949,25 @@ def main():
                        help='Starting position in the sorted video list (1-based index)')
     parser.add_argument('--number', type=int,
                        help='Number of videos to take from the position')
+    parser.add_argument('-j', '--jobs', type=int,
+                       help=f'Number of clips to re-encode in parallel (default: CPU count / {DEFAULT_THREADS_PER_FFMPEG})')
+    parser.add_argument('--ffmpeg-threads', type=int,
+                       default=os.environ.get('STITCH_FFMPEG_THREADS'),
+                       help=f'Threads per ffmpeg encode, {MIN_FFMPEG_THREADS}-{MAX_FFMPEG_THREADS} '
+                            '(default: $STITCH_FFMPEG_THREADS or CPU count / jobs)')
+    parser.add_argument('--batch-size', type=int, default=1,
+                       help='Clips re-encoded by each ffmpeg process; larger batches save process '
+                            'start-up time at the cost of memory (default: 1)')
+    parser.add_argument('--fast-copy', action='store_true',
+                       help='If all clips are H.264 at the target resolution with the same pixel '
+                            'format, join them without re-encoding (ignored with --numbered)')
+    parser.add_argument('--encoder', default='auto', choices=ENCODER_CHOICES,
+                       help='H.264 encoder for the per-clip re-encode (default: auto, '
+                            'uses a hardware encoder when one works and falls back to libx264)')
+    parser.add_argument('--preset', choices=X264_PRESETS,
+                       help=f'libx264 preset for the per-clip re-encode (default: {DEFAULT_PRESET})')
+    parser.add_argument('--tune', choices=['fastdecode', 'zerolatency', 'film', 'animation'],
+                       help="Optional libx264 tune; 'fastdecode' makes the output cheaper to play back at the cost of a larger file")
 
     args = parser.parse_args()
 
@@ -300,9 +984,17 @@ def main():
         sys.exit(1)
 
 
-    # Converting to 4:3 is now mandatory, therefore we must re-encode at least
-    # once. In addition, numbering requires re-encoding as well.
-    args.re_encode = True
+    if args.jobs is not None and args.jobs < 1:
+        print("❌ Error: --jobs must be at least 1")
+        sys.exit(1)
+
+    if args.batch_size < 1:
+        print("❌ Error: --batch-size must be at least 1")
+        sys.exit(1)
+
+    if args.ffmpeg_threads is not None and not MIN_FFMPEG_THREADS <= args.ffmpeg_threads <= MAX_FFMPEG_THREADS:
+        print(f"❌ Error: --ffmpeg-threads must be between {MIN_FFMPEG_THREADS} and {MAX_FFMPEG_THREADS}")
+        sys.exit(1)
 
     # Parse resolution string
     try:
@@ -329,16 +1021,32 @@ def main():
         args.output = '_'.join(filename_parts) + '.mp4'
         print(f"📝 Auto-generated output filename: {args.output}")
 
+    # ffmpeg children run in their own session, so Ctrl-C only reaches this
+    # process; stop them here rather than leaving them running
+    signal.signal(signal.SIGINT, _handle_sigint)
+
     # Run the stitching process
-    success = stitch_videos(
-        input_dir=input_dir,
-        output_file=args.output,
-        check_compatibility=not args.no_check,
-        numbered=args.numbered,
-        position=args.position,
-        number=args.number,
-        target_resolution=(res_w, res_h)
-    )
+    try:
+        success = stitch_videos(
+            input_dir=input_dir,
+            output_file=args.output,
+            check_compatibility=not args.no_check,
+            numbered=args.numbered,
+            position=args.position,
+            number=args.number,
+            target_resolution=(res_w, res_h),
+            jobs=args.jobs,
+            ffmpeg_threads=args.ffmpeg_threads,
+            encoder=args.encoder,
+            preset=args.preset,
+            tune=args.tune,
+            re_encode=args.re_encode,
+            batch_size=args.batch_size,
+            fast_copy=args.fast_copy
+        )
+    except KeyboardInterrupt:
+        print("\n⏹️  Operation cancelled by user")
+        sys.exit(130)
     
     if not success:
         sys.exit(1)